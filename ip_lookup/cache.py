@@ -3,16 +3,30 @@
     Implement caching for IP lookup
 """
 
+import atexit
 import json.decoder
 import os
 import ipaddress
 import logging
+import socket
+import time
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
-DEFAULT_CACHE_FILE = "ip_networks_cache.json"
+import numpy
+import pybloom_live
+import pytricia
+
+DEFAULT_CACHE_FILE = "ip_networks_cache.jsonl"
 NOT_FOUND_FILE = "not_found_list.txt"
 CACHE_TIMEOUT_DAYS = 14
+FLUSH_INTERVAL_SECONDS = 5.0
+NOT_FOUND_BLOOM_CAPACITY = 100_000
+NOT_FOUND_BLOOM_ERROR_RATE = 0.001
+
+# list-item prefix for the multiline string form of ResolvedNetwork,
+# formatted once instead of per __str__ call
+DASH = f"{'-':>7}"
 
 
 class JsonFields:
@@ -33,20 +47,14 @@ class ResolvedNetwork:
     """
         Class-container for the information about network, received from RIR
     """
-    address: str = ""
-    description: str = ""
-    name: str = ""
-    cidr: str = ""
-    country: str = ""
-    registry: str = ""
-    fqdn: str = ""
-    created: str = ""
+    # instances are created once per looked-up address; slots halve the
+    # per-object memory footprint compared to a per-instance __dict__
+    __slots__ = ("address", "description", "name", "cidr",
+                 "country", "registry", "fqdn", "created")
 
     def __init__(self, address: str = "", cidr: str = "", description: str = "", name: str = "",
-                 country: str = "", registry: str = "", fqdn: str = "", **kwargs):
+                 country: str = "", registry: str = "", fqdn: str = ""):
         """
-            The constructor accepts either a set of parameters or a JSON could passed to it.
-
             :param str address: IPv4 address or network as string
             :param str cidr: the subnet that includes address
             :param str description: subnet description from RIR
@@ -54,48 +62,41 @@ class ResolvedNetwork:
             :param str country: country, where subnet is registered
             :param str registry: name of the RIR, responsible for the subnet
             :param str fqdn: FQDN that IP address resolved to
-
-            Kwargs:
-            :key json: dictionary, representing a JSON
-
         """
-        js = kwargs.get("json")
-
-        if js is None:
-            self.address = address
-            self.description = description
-            self.name = name
-            self.cidr = cidr
-            self.country = country
-            self.registry = registry
-            self.fqdn = fqdn
-
-        if js is not None:
-            self.address = js[JsonFields.ADDRESS]
-            self.cidr = js[JsonFields.CIDR]
-            self.description = js[JsonFields.DESCRIPTION]
-            self.name = js[JsonFields.NAME]
-            self.country = js[JsonFields.COUNTRY]
-            self.registry = js[JsonFields.REGISTRY]
-            self.fqdn = js[JsonFields.FQDN]
+        self.address = address
+        self.description = description
+        self.name = name
+        self.cidr = cidr
+        self.country = country
+        self.registry = registry
+        self.fqdn = fqdn
+        self.created = ""
 
     def to_dict(self) -> dict:
         """
             Convert object to dict/JSON
         """
-        return self.__dict__.copy()
+        return {
+            JsonFields.ADDRESS: self.address,
+            JsonFields.DESCRIPTION: self.description,
+            JsonFields.NAME: self.name,
+            JsonFields.CIDR: self.cidr,
+            JsonFields.COUNTRY: self.country,
+            JsonFields.REGISTRY: self.registry,
+            JsonFields.FQDN: self.fqdn
+        }
 
     def __str__(self) -> str:
         """
             Convert object to multiline string
         """
         return (f"{self.address}:\n"
-                f"{'-':>7} Name: {self.name}\n"
-                f"{'-':>7} Description: {self.description}\n"
-                f"{'-':>7} CIDR: {self.cidr}\n"
-                f"{'-':>7} Country: {self.country}\n"
-                f"{'-':>7} Registry: {self.registry}\n"
-                f"{'-':>7} FQDN: {self.fqdn}\n")
+                f"{DASH} Name: {self.name}\n"
+                f"{DASH} Description: {self.description}\n"
+                f"{DASH} CIDR: {self.cidr}\n"
+                f"{DASH} Country: {self.country}\n"
+                f"{DASH} Registry: {self.registry}\n"
+                f"{DASH} FQDN: {self.fqdn}\n")
 
 
 class NetworkCache():
@@ -103,54 +104,137 @@ class NetworkCache():
         Implements file-based caching to avoid redundant lookups by RIRs
         and thus rate-limiting on their end
     """
-    # List of CIDR that were not resolved
-    not_found: list = []
-    # { CIDR : { attr: value } }
-    cache: dict[str, dict[str,str]] = {}
-    # map IPv4Network object to CIDR as string for cache lookup
-    net_to_cidr: dict[ipaddress.IPv4Network, str] = {}
-
     def __init__(self, cache_file: str):
         """
             Load existing cache file, if present
         """
-        if os.path.isfile(cache_file):
-            try:
-                with open(cache_file, "r", encoding="utf-8") as cachedata:
-                    self.cache = json.load(cachedata)
+        # List of CIDR that were not resolved
+        self.not_found: list = []
+        # { CIDR : { attr: value } }
+        self.cache: dict[str, dict[str,str]] = {}
+        # patricia trie for longest-prefix-match cache lookup; maps CIDR to itself
+        self.trie: pytricia.PyTricia = pytricia.PyTricia(32)
+        self.cache_file = cache_file
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        # handle for the append-only log; opened on first write
+        self._append_handle = None
+        # guarantee that in-memory entries reach disk on shutdown
+        atexit.register(self.close)
+
+        # addresses that failed resolution in previous runs; consulted to
+        # skip the WHOIS retry loop for addresses that are known to fail
+        self._nf_bloom = pybloom_live.BloomFilter(capacity=NOT_FOUND_BLOOM_CAPACITY,
+                                                  error_rate=NOT_FOUND_BLOOM_ERROR_RATE)
+        if os.path.isfile(NOT_FOUND_FILE):
+            with open(NOT_FOUND_FILE, "r", encoding="utf-8") as file_obj:
+                for line in file_obj:
+                    line = line.strip()
+                    if not line or line in self._nf_bloom:
+                        continue
+                    try:
+                        self._nf_bloom.add(line)
+                    except IndexError:
+                        # filter at capacity – retry the remaining addresses
+                        break
 
-            except json.decoder.JSONDecodeError as e:
-                logging.error("Error with loading %s - Ensure this file is not corrupted\n%s",
-                              cache_file,
-                              str(e))
-                return
+        if os.path.isfile(cache_file):
+            line_count = 0
+            valid_count = 0
+            with open(cache_file, "r", encoding="utf-8") as cachedata:
+                for line in cachedata:
+                    line = line.strip()
+                    if not line:
+                        continue
+
+                    try:
+                        record: dict = json.loads(line)
+                    except json.decoder.JSONDecodeError as e:
+                        # torn line, e.g. from a crash mid-append; counted so
+                        # that compaction below rewrites a clean log
+                        logging.error("Skipping corrupted line in %s\n%s", cache_file, str(e))
+                        line_count += 1
+                        continue
+
+                    network = record.pop(JsonFields.CIDR, None)
+                    if network is None:
+                        continue
+
+                    # later lines override earlier ones
+                    line_count += 1
+                    valid_count += 1
+                    self.cache[network] = record
 
             stale_keys = []
-            now = datetime.now()
-            time_window = relativedelta(days=+CACHE_TIMEOUT_DAYS)
-            for entry in self.cache:
-                str_date = self.cache[entry].get(JsonFields.CREATED)
-                if str_date is None:
+            # ISO timestamps compare lexicographically, so a single cutoff
+            # string replaces a datetime parse per cached entry
+            cutoff = (datetime.now() - relativedelta(days=+CACHE_TIMEOUT_DAYS)).isoformat()
+            for entry, data in self.cache.items():
+                str_date = data.get(JsonFields.CREATED)
+                if str_date is None or str_date <= cutoff:
                     stale_keys.append(entry)
                     continue
 
-                expiry_date = datetime.fromisoformat(str_date) + time_window
-                if expiry_date <= now:
-                    stale_keys.append(entry)
+                self.trie.insert(entry, entry)
 
             for key in stale_keys:
                 del self.cache[key]
 
-            self.net_to_cidr = {ipaddress.ip_network(CIDR): CIDR for CIDR in self.cache.keys()}
+            # drop overridden and expired lines from disk; a file that
+            # yielded no valid record at all – e.g. a legacy pretty-printed
+            # JSON cache – is left untouched instead of being overwritten
+            if valid_count and len(self.cache) != line_count:
+                self.compact()
 
-    def save_cache(self, cache_file: str = DEFAULT_CACHE_FILE) -> None:
+    def save_cache(self) -> None:
         """
-            Persist cache to disk
+            Flush pending append-log entries to disk; O(1) regardless
+            of the cache size
+        """
+        if self._append_handle is not None:
+            self._append_handle.flush()
+            os.fsync(self._append_handle.fileno())
+
+        self._dirty = False
+        self._last_flush = time.monotonic()
 
-            :param str cache_file: path to cache file; optional
+    def compact(self) -> None:
+        """
+            Rewrite the append log with one line per unique CIDR, dropping
+            overridden and expired entries
+        """
+        self.close()
+
+        lines = [json.dumps({JsonFields.CIDR: network} | data)
+                 for network, data in self.cache.items()]
+        with open(self.cache_file, "w", encoding="utf-8") as file_obj:
+            # serialize first, then issue a single write instead of
+            # one small write per JSON element
+            file_obj.write("\n".join(lines) + "\n" if lines else "")
+
+    def close(self) -> None:
+        """
+            Flush and close the append log
         """
-        with open(cache_file, "w", encoding="utf-8") as file_obj:
-            json.dump(self.cache, file_obj, indent=4)
+        if self._append_handle is not None:
+            self._append_handle.flush()
+            self._append_handle.close()
+            self._append_handle = None
+
+    def maybe_flush(self, interval: float = FLUSH_INTERVAL_SECONDS) -> None:
+        """
+            Persist cache to disk, but only if it was modified and the flush
+            interval has elapsed since the previous write
+
+            :param float interval: minimum number of seconds between writes
+        """
+        if not self._dirty:
+            return
+
+        if time.monotonic() - self._last_flush < interval:
+            return
+
+        self.save_cache()
 
     def save_not_found(self) -> None:
         """
@@ -160,12 +244,37 @@ class NetworkCache():
             return
 
         with open(NOT_FOUND_FILE, "a", encoding="utf-8") as file_obj:
-            file_obj.write('\n'.join(self.not_found))
+            file_obj.write('\n'.join(self.not_found) + '\n')
 
         self.not_found = []
 
+    def mark_not_found(self, address: str) -> None:
+        """
+            Record an address that could not be resolved, so that later runs
+            do not retry it
+
+            :param str address: IP address or network in CIDR notation
+        """
+        self.not_found.append(address)
+
+        if address not in self._nf_bloom:
+            try:
+                self._nf_bloom.add(address)
+            except IndexError:
+                # filter at capacity – such addresses will be retried
+                pass
+
+    def is_known_not_found(self, address: str) -> bool:
+        """
+            Check, whether an address already failed resolution in this or
+            a previous run
+
+            :param str address: IP address or network in CIDR notation
+        """
+        return address in self._nf_bloom
+
     def set(self, network: str, name: str, description: str,
-            country: str, registry: str, fqdn: str) -> None:
+            country: str, registry: str, fqdn: str, created: str = None) -> None:
         """
             Add an entry to the cache in-memory
 
@@ -175,60 +284,97 @@ class NetworkCache():
             :param str country: country, where CIDR is registered
             :param str registry: RIR, responsible for the CIDR
             :param str fqdn: FQDN that the hostname resolves to (/32 or hosts only)
+            :param str created: entry timestamp in ISO format; current time if None
         """
-        self.cache[network] = {
+        data = {
             JsonFields.NAME: name,
             JsonFields.DESCRIPTION: description,
             JsonFields.COUNTRY: country,
             JsonFields.REGISTRY: registry,
             JsonFields.FQDN: fqdn,
-            JsonFields.CREATED: datetime.now().isoformat()
+            JsonFields.CREATED: created if created is not None else datetime.now().isoformat()
         }
+        self.cache[network] = data
+
+        # append one line to the log; flushing is left to maybe_flush()
+        if self._append_handle is None:
+            self._append_handle = open(self.cache_file, "a", encoding="utf-8")
+        self._append_handle.write(json.dumps({JsonFields.CIDR: network} | data) + "\n")
+        self._dirty = True
 
-        # add to networks hash
+        # add to networks trie
         try:
-            self.net_to_cidr[ipaddress.ip_network(network)] = network
+            self.trie.insert(network, network)
         except ValueError:
             logging.error("Value error adding network to cache. network=%s _ name=%s",
                           network, name)
 
-    def _get(self, address: str, network: str) -> dict[str,str]:
+    def get_network(self, address: str, network: str) -> ResolvedNetwork:
         """
-            Get network data from cache by CIDR as JSON
+            Get network data from cache by CIDR as ResolvedNetwork
 
             :param str address: value to be translated by RIR
             :param str network: CIDR that matches address
 
-            :return dict[str,str]: dict, corresponding to JSON entry in cache
+            :return ResolvedNetwork: object, corresponding to JSON entry in cache
         """
-        net_name: str = self.cache[network][JsonFields.NAME]
-        net_country: str = self.cache[network][JsonFields.COUNTRY]
-        net_description: str = self.cache[network][JsonFields.DESCRIPTION]
-        net_registry: str = self.cache[network][JsonFields.REGISTRY]
-        net_rdns_fqdn: str = self.cache[network][JsonFields.FQDN]
-
-        return {JsonFields.ADDRESS: address, JsonFields.CIDR: network, JsonFields.NAME: net_name,
-                JsonFields.COUNTRY: net_country, JsonFields.REGISTRY: net_registry,
-                JsonFields.DESCRIPTION: net_description, JsonFields.FQDN: net_rdns_fqdn }
-
-    def get_network(self, address: str, network: str) -> ResolvedNetwork:
+        record = self.cache[network]
+        return ResolvedNetwork(address=address, cidr=network,
+                               name=record[JsonFields.NAME],
+                               country=record[JsonFields.COUNTRY],
+                               description=record[JsonFields.DESCRIPTION],
+                               registry=record[JsonFields.REGISTRY],
+                               fqdn=record[JsonFields.FQDN])
+
+    def batch_in_cache(self, ip_ints: numpy.ndarray) -> list[str | None]:
         """
-            Get network data from cache by CIDR as ResolvedNetwork
+            Check cache membership for a whole batch of addresses in one
+            vectorized pass over (network, mask) arrays, instead of one
+            trie walk per address
 
-            :param str address: value to be translated by RIR
-            :param str network: CIDR that matches address
+            :param numpy.ndarray ip_ints: addresses as packed uint32 values
 
-            :return ResolvedNetwork: object, corresponding to JSON entry in cache
+            :return list[str | None]: matching CIDR per address; None if not cached
         """
-        return ResolvedNetwork(json=self._get(address, network))
+        if len(self.cache) == 0 or ip_ints.size == 0:
+            return [None] * int(ip_ints.size)
+
+        def _plen(cidr: str) -> int:
+            plen_str = cidr.partition("/")[2]
+            return int(plen_str) if plen_str.isnumeric() else 32
+
+        # CIDRs sorted by prefix length descending, so that the first
+        # match per address is the longest prefix
+        cidrs: list[str] = sorted(self.cache.keys(), key=_plen, reverse=True)
+        nets: list[int] = []
+        masks: list[int] = []
+        for cidr in cidrs:
+            host, _, plen_str = cidr.partition("/")
+            try:
+                plen = int(plen_str or 32)
+                if not 0 < plen <= 32:
+                    raise ValueError(f"prefix length {plen} out of range")
+                mask = (0xFFFFFFFF << (32 - plen)) & 0xFFFFFFFF
+                net = int.from_bytes(socket.inet_aton(host), "big") & mask
+            except (OSError, ValueError):
+                # malformed CIDR from a RIR response; make it unmatchable –
+                # no address satisfies ip & 0 == 1
+                mask, net = 0, 1
+            masks.append(mask)
+            nets.append(net)
+
+        net_arr = numpy.array(nets, dtype=numpy.uint32)
+        mask_arr = numpy.array(masks, dtype=numpy.uint32)
+
+        matches = (ip_ints[:, None] & mask_arr) == net_arr
+        first = matches.argmax(axis=1)
+        found = matches.any(axis=1)
+
+        return [cidrs[idx] if hit else None for idx, hit in zip(first, found)]
 
     def in_cache(self, address: ipaddress.IPv4Address) -> str | None:
         """
-            Check, whether IP address is included in any cache entries, by searching
-            the CIRR-to-IPv4Network map for a match
+            Check, whether IP address is included in any cache entries, by performing
+            a longest-prefix match against the trie of cached CIDRs
         """
-        for net in self.net_to_cidr.keys():
-            if address in net:
-                return self.net_to_cidr[net]
-
-        return None
+        return self.trie.get(str(address))
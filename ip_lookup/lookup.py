@@ -3,12 +3,19 @@
 """
 import time
 import socket
+import functools
 import ipaddress
 import logging
+import random
 import re
+import threading
+import urllib.error
+import concurrent.futures
 
+from datetime import datetime
 from enum import Enum
 
+import numpy
 import pandas
 import ipwhois, ipwhois.utils
 import openpyxl
@@ -20,7 +27,12 @@ RETRY_COUNT_MAX: int = 3
 SLEEP_TIME = 2
 SLEEP_INTERVAL = 10
 CACHE_SAVE_INTERVAL = 100
-TIMEOUT_SLEEP = 10
+BACKOFF_MAX = 60
+MAX_WORKERS = 8
+RDNS_CACHE_SIZE = 8192
+# keep the same average request rate towards RIRs as the old
+# "sleep SLEEP_TIME every SLEEP_INTERVAL lookups" pacing
+LOOKUP_MIN_INTERVAL = SLEEP_TIME / SLEEP_INTERVAL
 EXCEL_ENTRIES_MARKER = "Entries"
 EXCEL_ENTRIES_MAX_SEARCH = 10
 EXCEL_MAX_COLS = 100
@@ -29,6 +41,38 @@ ReservedNetNames = [
     "IANA-BLK"
 ]
 
+# Roughly matches entries that resemble IPs or subnets
+IP_SHAPED_RE = re.compile(r"^[\d./]+$")
+
+# Translation table for flattening multiline RIR fields
+NEWLINE_TABLE = str.maketrans({"\n": " ", "\r": " "})
+
+
+@functools.lru_cache(maxsize=RDNS_CACHE_SIZE)
+def _rdns(host: str) -> str:
+    """
+        Resolve an address to its FQDN; failed resolutions are cached
+        as empty strings, so repeats do not pay the DNS latency again
+
+        :param str host: IP address without the mask part
+    """
+    try:
+        return socket.gethostbyaddr(host)[0]
+    except OSError:
+        return ""
+
+
+def _clean(value) -> str:
+    """
+        Flatten a RIR response field into a single-line string
+
+        :param value: field value from the WHOIS response; may be None
+    """
+    if not value:
+        return ""
+
+    return str(value).translate(NEWLINE_TABLE)
+
 
 class Descriptions(Enum):
     """
@@ -41,25 +85,49 @@ class Descriptions(Enum):
     INVALID_IP_DESCR = "Invalid IP Address"
 
 
+class RateLimiter:
+    """
+        Enforce a minimum interval between WHOIS requests across worker threads,
+        so that parallel lookups do not query RIRs faster than the previous
+        sequential pacing did
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def wait(self) -> None:
+        """
+            Block until the next request slot is available
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
 class RirSearcher:
     """
         Performs RIR or cache lookup for addresses from text file or
         SSL inspection spreadsheet
     """
-    resolved_ip_list: list[ResolvedNetwork] = []
-    raw_ip_list: list[str] = []
-    cache: NetworkCache = None
-    start_cache_size: int = 0
-
     def __init__(self, ip_file_name: str = None, cache_file_name: str = DEFAULT_CACHE_FILE):
-        self.cache = NetworkCache(cache_file_name)
-        self.start_cache_size = len(self.cache.cache)
+        self.resolved_ip_list: list[ResolvedNetwork] = []
+        self.raw_ip_list: list[str] = []
+        self.cache: NetworkCache = NetworkCache(cache_file_name)
+        # serializes cache mutations between worker threads
+        self._cache_lock = threading.Lock()
+        self._rate_limiter = RateLimiter(LOOKUP_MIN_INTERVAL)
+        # per-run results by input address; spreadsheets contain many
+        # repeated entries, which then skip even the trie lookup
+        self._session_seen: dict[str, ResolvedNetwork] = {}
 
         if ip_file_name is not None:
-            with open(ip_file_name, "r", encoding="utf-8") as file:
-                # Remove /n part of the address along with whitespaces
-                self.raw_ip_list: list[str] = [line.replace("\n", "").replace(" ", "")
-                                               for line in file]
+            self.reload_file(ip_file_name)
 
     def reload_file(self, ip_file_name: str) -> None:
         """
@@ -68,9 +136,9 @@ class RirSearcher:
             :param str ip_file_name: path to the file with IP list
         """
         with open(ip_file_name, "r", encoding="utf-8") as file:
-            # Remove /n part of the address along with whitespaces
-            self.raw_ip_list: list[str] = [line.replace("\n", "").replace(" ", "")
-                                           for line in file]
+            # Trim whitespace in a single pass and drop blank lines
+            self.raw_ip_list: list[str] = [address for line in file
+                                           if (address := line.strip())]
 
     def _check_known_nets(self, address: str)\
             -> tuple[ipaddress.IPv4Address | None, ResolvedNetwork | None]:
@@ -84,25 +152,34 @@ class RirSearcher:
         """
         host_addr: str = address.split("/")[0]
         try:
-            ip: ipaddress.IPv4Address = ipaddress.ip_address(host_addr)
-        except ValueError:
+            # single C-level parse; range checks below are plain integer
+            # comparisons instead of IPv4Address property lookups, each of
+            # which walks a list of networks internally. inet_pton rejects
+            # the same short forms ipaddress.ip_address does, unlike inet_aton
+            packed: int = int.from_bytes(socket.inet_pton(socket.AF_INET, host_addr), "big")
+        except OSError:
             return None, ResolvedNetwork(address=address,
                                          description=Descriptions.INVALID_IP_DESCR.value)
 
         # Exclude well-known addresses
-        if ip.is_private:
+        if (0x0A000000 <= packed <= 0x0AFFFFFF          # 10.0.0.0/8
+                or 0xAC100000 <= packed <= 0xAC1FFFFF   # 172.16.0.0/12
+                or 0xC0A80000 <= packed <= 0xC0A8FFFF   # 192.168.0.0/16
+                or 0xA9FE0000 <= packed <= 0xA9FEFFFF): # 169.254.0.0/16 (APIPA)
             return None, ResolvedNetwork(address=address,
                                          description=Descriptions.PRIVATE_IP_DESCR.value)
-        if ip.is_loopback:
+        if 0x7F000000 <= packed <= 0x7FFFFFFF:          # 127.0.0.0/8
             return None, ResolvedNetwork(address=address,
                                          description=Descriptions.LOOPBACK_IP_DESCR.value)
-        if ip.is_multicast:
+        if 0xE0000000 <= packed <= 0xEFFFFFFF:          # 224.0.0.0/4
             return None, ResolvedNetwork(address=address,
                                          description=Descriptions.MCAST_IP_DESCR.value)
-        if ip.is_unspecified or ip.is_reserved:
+        if packed == 0 or packed >= 0xF0000000:         # 0.0.0.0 and 240.0.0.0/4
             return None, ResolvedNetwork(address=address,
                                          description=Descriptions.RSVD_IP_DESCR.value)
 
+        ip: ipaddress.IPv4Address = ipaddress.IPv4Address(packed)
+
         is_defined = ipwhois.utils.ipv4_is_defined(host_addr)
         if is_defined[0]:
             return None, ResolvedNetwork(address=address,
@@ -111,7 +188,36 @@ class RirSearcher:
                                          )
         return ip, None
 
-    def single_lookup(self, address: str, persist: bool = True)\
+    def _prepare(self, address: str)\
+            -> tuple[ipaddress.IPv4Address | None, bool, ResolvedNetwork | None]:
+        """
+            Perform the fast, local part of a lookup: well-known network
+            and cache checks.
+
+            :param str address: IP address or network in CIDR notation
+
+            :return IPv4Address ip: address to resolve remotely; None if already resolved
+            :return bool cached: is found in cache
+            :return ResolvedNetwork resolved_net: resolved entry; None if remote lookup is needed
+        """
+        ip, resolved_net = self._check_known_nets(address)
+
+        if resolved_net is not None:
+            return None, False, resolved_net
+
+        # Check if the same input was already resolved during this run
+        if (seen := self._session_seen.get(address)) is not None:
+            return None, True, seen
+
+        # Check if IP in cache
+        if net := self.cache.in_cache(ip):
+            resolved_net = self.cache.get_network(address, net)
+            self._session_seen[address] = resolved_net
+            return None, True, resolved_net
+
+        return ip, False, None
+
+    def single_lookup(self, address: str, persist: bool = False)\
             -> tuple[bool, bool, bool, ResolvedNetwork | None]:
         """
             Perform an address resolution for a single entry.
@@ -124,29 +230,69 @@ class RirSearcher:
             :return bool error: has error occurred during lookup
             :return ResolvedNetwork resolved_net: None if error, resolved entry otherwise
         """
-        ip, resolved_net = self._check_known_nets(address)
+        ip, cached, resolved_net = self._prepare(address)
 
         if resolved_net is not None:
-            return True, False, False, resolved_net
+            return not cached, cached, False, resolved_net
 
-        # Check if IP in cache
-        if net := self.cache.in_cache(ip):
-            data = self.cache.get_network(address, net)
-            return False, True, False, data
+        error, resolved_net = self._remote_lookup(ip, address)
+
+        if error:
+            return False, False, True, None
+
+        if persist:
+            self.cache.maybe_flush()
+            self.cache.save_not_found()
+
+        return False, False, False, resolved_net
+
+    def _remote_lookup(self, ip: ipaddress.IPv4Address, address: str)\
+            -> tuple[bool, ResolvedNetwork | None]:
+        """
+            Perform the slow, network-bound part of a lookup: WHOIS query and
+            reverse DNS resolution. Safe to call from worker threads.
+
+            :param IPv4Address ip: host part of the address
+            :param str address: IP address or network in CIDR notation
+
+            :return bool error: has error occurred during lookup
+            :return ResolvedNetwork resolved_net: None if error, resolved entry otherwise
+        """
+        # Skip addresses that already failed resolution in this or a previous
+        # run; saves the whole WHOIS retry loop for addresses known to fail
+        if self.cache.is_known_not_found(address):
+            return True, None
 
         whois: ipwhois.IPWhois = ipwhois.IPWhois(str(ip))
         retry_count = 0
         response: dict = {}
+        last_error: type = None
         while retry_count < RETRY_COUNT_MAX:
+            self._rate_limiter.wait()
             try:
                 response = whois.lookup_whois()
                 break
-            except TimeoutError:
-                # wait a few moments before trying again
-                logging.info("Pausing lookup for %s seconds because of likely timeout error",
-                             TIMEOUT_SLEEP)
+            except (TimeoutError, urllib.error.URLError) as e:
+                if isinstance(e, urllib.error.URLError)\
+                        and not isinstance(e.reason, TimeoutError):
+                    # URLError covers non-transient failures as well
+                    logging.warning("Lookup failed for %s with exception %s", address, str(e))
+                    break
+
+                if type(e) is last_error:
+                    # second failure of the same kind – unlikely to recover
+                    logging.warning("Giving up lookup for %s after repeated %s",
+                                    address, type(e).__name__)
+                    break
+
+                last_error = type(e)
                 retry_count += 1
-                time.sleep(TIMEOUT_SLEEP)
+                # exponential backoff with jitter, so that worker threads
+                # do not retry against the RIR in lockstep
+                backoff = min(BACKOFF_MAX, 2 ** retry_count + random.uniform(0, 1))
+                logging.info("Pausing lookup for %.1f seconds because of likely timeout error",
+                             backoff)
+                time.sleep(backoff)
             except (ipwhois.exceptions.HTTPLookupError, ipwhois.exceptions.WhoisLookupError,
                     ipwhois.exceptions.ASNParseError) as e:
                 logging.warning("Lookup failed for %s with exception %s", address, str(e))
@@ -154,31 +300,29 @@ class RirSearcher:
                 break
 
         if retry_count == RETRY_COUNT_MAX or not response:
-            self.cache.not_found.append(address)
-            return False, False, True, None
+            with self._cache_lock:
+                self.cache.mark_not_found(address)
+            return True, None
 
         # Build description and append to output list
         if len(response["nets"]) > 0:
-            net_cidr: str = str(response["nets"][0]["cidr"]).replace("\n", " ")
-            net_name: str = str(response["nets"][0]["name"]).replace("\n", " ")
-            net_description: str = str(response["nets"][0]["description"]).replace("\n", " ")
-            net_country: str = str(response["nets"][0]["country"]).replace("\n", " ")
+            net_cidr: str = _clean(response["nets"][0]["cidr"])
+            net_name: str = _clean(response["nets"][0]["name"])
+            net_description: str = _clean(response["nets"][0]["description"])
+            net_country: str = _clean(response["nets"][0]["country"])
         else:
-            net_cidr: str = str(response["asn_cidr"]).replace("\n", " ")
+            net_cidr: str = _clean(response["asn_cidr"])
             net_name: str = ""
-            net_description: str = str(response["asn_description"]).replace("\n", " ")
-            net_country: str = str(response["asn_country_code"]).replace("\n", " ")
+            net_description: str = _clean(response["asn_description"])
+            net_country: str = _clean(response["asn_country_code"])
 
-        net_registry: str = str(response["asn_registry"]).replace("\n", " ")
+        net_registry: str = _clean(response["asn_registry"])
         net_rdns_fqdn: str = ""
 
         host_and_mask = address.split("/")
 
         if len(host_and_mask) == 1 or host_and_mask[1].isnumeric() and 32 == int(host_and_mask[1]):
-            try:
-                net_rdns_fqdn = socket.gethostbyaddr(host_and_mask[0])[0]
-            except socket.herror:
-                pass
+            net_rdns_fqdn = _rdns(host_and_mask[0])
 
         resolved_net = ResolvedNetwork(address=address, name=net_name, cidr=net_cidr,
                                       country=net_country, registry=net_registry,
@@ -192,60 +336,90 @@ class RirSearcher:
             if subnets[0] in [None, "NA"]:
                 subnets = response['nets'][0]['cidr'].replace(" ", "").split(",")
 
-            # Add to cache for subnet in response
-            for net in subnets:
-                self.cache.set(net, net_name, net_description,
-                               net_country, net_registry, net_rdns_fqdn)
+            # Add to cache for subnet in response; timestamp is computed once
+            # per response instead of once per subnet
+            now_iso = datetime.now().isoformat()
+            with self._cache_lock:
+                for net in subnets:
+                    self.cache.set(net, net_name, net_description,
+                                   net_country, net_registry, net_rdns_fqdn, now_iso)
 
-            if persist:
-                self.cache.save_cache(DEFAULT_CACHE_FILE)
-                self.cache.save_not_found()
+        self._session_seen[address] = resolved_net
 
-        return False, False, False, resolved_net
+        return False, resolved_net
 
     def search_list(self):
         """
             Search the list of IP addresses from the file. Filename can either be
             specified during class init or the list can be manually updated.
         """
-        ip_list = self.raw_ip_list.copy()
         cache_hits = 0
         lookups = 0
+        # results by input position, so that exports keep the input order;
+        # None marks a pending remote lookup
+        results: list[ResolvedNetwork | None] = [None] * len(self.raw_ip_list)
+        candidates: list[tuple[int, str, ipaddress.IPv4Address]] = []
 
-        while len(ip_list) != 0:
-            address: str = ip_list.pop(0)
-            known_net, cached, error, resolved_net = self.single_lookup(address, persist=False)
+        for index, address in enumerate(self.raw_ip_list):
+            ip, resolved_net = self._check_known_nets(address)
 
-            if known_net:
-                self.resolved_ip_list.append(resolved_net)
+            if resolved_net is not None:
+                results[index] = resolved_net
                 continue
 
-            if cached:
+            candidates.append((index, address, ip))
+
+        # Test cache membership for the whole batch in one vectorized pass
+        # instead of one trie walk per address
+        ip_ints = numpy.fromiter((int(ip) for _, _, ip in candidates),
+                                 dtype=numpy.uint32, count=len(candidates))
+        pending: list[tuple[int, str, ipaddress.IPv4Address]] = []
+
+        for (index, address, ip), net in zip(candidates, self.cache.batch_in_cache(ip_ints)):
+            if net is not None:
                 cache_hits += 1
-                self.resolved_ip_list.append(resolved_net)
+                results[index] = self.cache.get_network(address, net)
                 continue
 
-            # Perform lookup with RIR
-            lookups += 1
+            pending.append((index, address, ip))
 
-            if error:
-                self.cache.not_found.append(address)
-                continue
+        # Submit each distinct address once; duplicate occurrences are served
+        # from the first occurrence's future
+        unique_pending: dict[str, ipaddress.IPv4Address] = {}
+        for _, address, ip in pending:
+            unique_pending.setdefault(address, ip)
 
-            if lookups % SLEEP_INTERVAL == 0:
-                logging.info("Sleeping %s seconds after another %s lookups. Total lookups: %s",
-                             SLEEP_TIME, SLEEP_INTERVAL, lookups)
-                time.sleep(SLEEP_TIME)
+        # Perform remaining lookups with RIR in parallel – WHOIS and reverse
+        # DNS are network-bound, so worker threads overlap their latencies
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            future_map = {address: executor.submit(self._remote_lookup, ip, address)
+                          for address, ip in unique_pending.items()}
 
-            if lookups % CACHE_SAVE_INTERVAL == 0:
-                # save cache file to not lose progress
-                self.cache.save_cache(DEFAULT_CACHE_FILE)
+            looked_up: set[str] = set()
+            for index, address, _ in pending:
+                error, resolved_net = future_map[address].result()
+
+                if address in looked_up:
+                    cache_hits += 1
+                else:
+                    looked_up.add(address)
+                    lookups += 1
 
-            self.resolved_ip_list.append(resolved_net)
+                if error:
+                    continue
+
+                if lookups % CACHE_SAVE_INTERVAL == 0:
+                    # save cache file to not lose progress
+                    with self._cache_lock:
+                        self.cache.maybe_flush()
+
+                results[index] = resolved_net
+
+        # failed lookups leave None placeholders behind
+        self.resolved_ip_list.extend(net for net in results if net is not None)
 
         # Save cache if modified
-        if len(self.cache.cache) > self.start_cache_size:
-            self.cache.save_cache(DEFAULT_CACHE_FILE)
+        self.cache.maybe_flush(interval=0.0)
 
         self.cache.save_not_found()
 
@@ -283,67 +457,71 @@ class RirSearcher:
             if entries_start_row == -1:
                 continue
 
+            # Bulk-read values once – openpyxl's per-cell access is slow,
+            # Cell objects are materialized only for cells that get rewritten
+            header: tuple = next(ws.iter_rows(min_row=1, max_row=1,
+                                              max_col=EXCEL_MAX_COLS, values_only=True))
+            rows: list[tuple] = list(ws.iter_rows(min_row=entries_start_row,
+                                                  max_col=EXCEL_MAX_COLS, values_only=True))
+            ip_cells: list[tuple[int, int, str]] = []
+
             for col in range(2, EXCEL_MAX_COLS):
                 # If column is empty, not further lists are available in the sheet
-                if ws.cell(row=1, column=col).value == "":
+                if header[col - 1] == "":
                     break
 
-                # Iterate over cells and resolve IPs
-                row = entries_start_row - 1
-                while True:
-                    row += 1
-                    entry = ws.cell(row=row, column=col).value
-                    ws.cell(row=row, column=col).alignment = align_multiline
+                # Iterate over values and collect IP-shaped entries
+                for offset, values in enumerate(rows):
+                    entry = values[col - 1]
 
                     # If cell is empty or not defined, list has ended
                     if entry == "" or entry is None:
                         break
 
-                    # Roughly select entries that resemble IPs or subnets
-                    if re.match(r"^[\d\.\/]+$", entry) is None:
+                    # Roughly select entries that resemble IPs or subnets;
+                    # the first-character check skips the regex for most cells
+                    if entry[0] not in "0123456789" or IP_SHAPED_RE.match(entry) is None:
                         continue
 
-                    address = entry.replace("\n", "")#.split("/")[0]
+                    ip_cells.append((entries_start_row + offset, col, entry))
 
-                    # If value cannot be converted to IPv4Address – skip
-                    try:
-                        known_net, cached, error, resolved_net =(
-                            self.single_lookup(address=address, persist=False))
-                    except ValueError:
-                        continue
+            for row, col, entry in ip_cells:
+                address = entry.replace("\n", "")#.split("/")[0]
 
-                    # Mark cell with colour as containing IP address
-                    ws.cell(row=row, column=col).fill = background_fill
+                # If value cannot be converted to IPv4Address – skip
+                try:
+                    known_net, cached, error, resolved_net =(
+                        self.single_lookup(address=address, persist=False))
+                except ValueError:
+                    continue
 
-                    if error:
-                        ws.cell(row=row, column=col).value = f"{entry}\n\nNOT FOUND"
-                        continue
+                cell = ws.cell(row=row, column=col)
+                cell.alignment = align_multiline
+                # Mark cell with colour as containing IP address
+                cell.fill = background_fill
 
-                    ws.cell(row=row, column=col).value = str(resolved_net)
-                    lookups += 1
+                if error:
+                    cell.value = f"{entry}\n\nNOT FOUND"
+                    continue
 
-                    if known_net:
-                        continue
+                cell.value = str(resolved_net)
+                lookups += 1
 
-                    if cached:
-                        cache_hits += 1
-                        continue
+                if known_net:
+                    continue
 
-                    if lookups % SLEEP_INTERVAL == 0:
-                        logging.info("Sleeping %s seconds after another %s lookups. "
-                                     "Total lookups: %s",
-                                     SLEEP_TIME, SLEEP_INTERVAL, lookups)
-                        time.sleep(SLEEP_TIME)
+                if cached:
+                    cache_hits += 1
+                    continue
 
-                    if lookups % CACHE_SAVE_INTERVAL == 0:
-                        # save cache file to not lose progress
-                        self.cache.save_cache(DEFAULT_CACHE_FILE)
+                if lookups % CACHE_SAVE_INTERVAL == 0:
+                    # save cache file to not lose progress
+                    self.cache.maybe_flush()
 
         logging.info("cache_hits=%s | lookups=%s", cache_hits, lookups)
 
         # Save cache if modified
-        if len(self.cache.cache) > self.start_cache_size:
-            self.cache.save_cache(DEFAULT_CACHE_FILE)
+        self.cache.maybe_flush(interval=0.0)
 
         self.cache.save_not_found()
 
@@ -72,7 +72,7 @@ if __name__ == '__main__':
                 output.append(x.to_dict())
 
             with open(args.json_export, "w", encoding="utf-8") as f:
-                json.dump(output, f, indent=4, default=list)
+                f.write(json.dumps(output, indent=4, default=list))
 
         if args.excel_export is not None:
             logging.info("Saving IPs from text file to Excel %s", args.excel_export)